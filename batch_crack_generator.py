@@ -0,0 +1,385 @@
+import argparse
+import glob
+import multiprocessing as mp
+import multiprocessing.connection as mp_connection
+import os
+import re
+import signal
+import sys
+import time
+
+# Torch and diffusers are imported inside the workers, after each process has
+# been pinned to its cores and given its thread budget, so that the OpenMP/MKL
+# thread pools are sized correctly from the start.
+
+
+def find_jobs(original_images_dir, generated_masks_dir, output_dir):
+    """
+    Build the job list from the crack mask folders.
+
+    Masks are expected at {generated_masks_dir}/cracks_*/{image_name}_mask_crack*_{iteration}.png
+    and are paired with {original_images_dir}/{image_name}.png.
+
+    Args:
+        original_images_dir: Directory with the cropped original images
+        generated_masks_dir: Directory containing the cracks_* subfolders
+        output_dir: Directory where generated images are written
+
+    Returns:
+        Tuple of (list of (image_path, mask_path, output_path) jobs, list of masks without an original image)
+    """
+    jobs = []
+    missing = []
+    for size_folder in sorted(glob.glob(os.path.join(generated_masks_dir, "cracks_*"))):
+        if not os.path.isdir(size_folder):
+            continue
+        size_name = os.path.basename(size_folder)
+
+        for mask_path in sorted(glob.glob(os.path.join(size_folder, "*_mask_*.png"))):
+            if not os.path.isfile(mask_path):
+                continue
+            mask_basename = os.path.basename(mask_path)
+
+            # e.g. "001_cropped" from "001_cropped_mask_crack3_50_150_1.png"
+            image_name = re.sub(r"_mask_crack.*", "", mask_basename)
+            image_path = os.path.join(original_images_dir, f"{image_name}.png")
+            if not os.path.isfile(image_path):
+                missing.append(mask_path)
+                continue
+
+            match = re.search(r"_(\d+)\.png$", mask_basename)
+            mask_iteration = match.group(1) if match else os.path.splitext(mask_basename)[0]
+            output_path = os.path.join(output_dir, f"{image_name}_{size_name}_crack_{mask_iteration}.png")
+            jobs.append((image_path, mask_path, output_path))
+    return jobs, missing
+
+
+def parse_cpu_list(text):
+    """
+    Parse a Linux CPU list such as "0-3,32-35" into a sorted list of CPU ids.
+    """
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """
+    Format CPU ids as a compact Linux CPU list, e.g. [0, 1, 2, 32, 33] -> "0-2,32-33".
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def physical_cores(cpus):
+    """
+    Group logical CPUs by the physical core they run on.
+
+    SMT siblings are read from /sys/devices/system/cpu/cpu*/topology/thread_siblings_list.
+    Where that is unavailable, each logical CPU is treated as its own core.
+
+    Args:
+        cpus: Usable logical CPU ids
+
+    Returns:
+        List of logical CPU id lists, one per physical core, ordered by lowest CPU id
+    """
+    cores = {}
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                siblings = tuple(parse_cpu_list(f.read()))
+        except (OSError, ValueError):
+            siblings = (cpu,)
+        cores.setdefault(siblings, []).append(cpu)
+    return sorted(cores.values())
+
+
+def partition_cores(cores, num_workers, threads_per_worker):
+    """
+    Split the physical cores into disjoint sets, one per worker.
+
+    Each worker gets threads_per_worker whole physical cores, including their
+    SMT siblings, so no two workers share a physical core.
+
+    Args:
+        cores: List of physical cores, each a list of logical CPU ids (see physical_cores)
+        num_workers: Number of worker processes
+        threads_per_worker: Number of physical cores given to each worker
+
+    Returns:
+        List of sorted logical CPU id lists, one per worker
+    """
+    if num_workers * threads_per_worker > len(cores):
+        raise ValueError(f"{num_workers} workers x {threads_per_worker} threads needs "
+                         f"{num_workers * threads_per_worker} physical cores, only {len(cores)} available")
+    return [sorted(cpu for core in cores[i * threads_per_worker:(i + 1) * threads_per_worker] for cpu in core)
+            for i in range(num_workers)]
+
+
+def worker(worker_id, cpus, num_threads, device, gen_kwargs, job_queue, result_conn):
+    """
+    Pin this process to its CPUs, load a pipeline and process jobs until the queue is drained.
+
+    Jobs are pulled one at a time from the shared queue, so faster workers
+    simply take more jobs. The worker reports "ready" once its pipeline is
+    loaded (or "failed" if loading raised), then "start" and a result for each
+    job, and finally its timing summary on result_conn. Sends are unbuffered,
+    so everything reported before a crash reaches the parent.
+    """
+    # Ctrl-C is handled by the parent, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    start = time.perf_counter()
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        import torch
+        from crack_generator import load_pipeline, generate_crack_image
+        torch.set_num_threads(num_threads)
+        pipe = load_pipeline(device)
+    except Exception as e:
+        result_conn.send(("failed", worker_id, f"{type(e).__name__}: {e}"))
+        return
+    load_time = time.perf_counter() - start
+    result_conn.send(("ready", worker_id))
+
+    busy_time = 0.0
+    num_jobs = 0
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        image_path, mask_path, output_path = job
+        # Lets the parent name the mask if this process dies mid-job
+        result_conn.send(("start", worker_id, mask_path))
+        job_start = time.perf_counter()
+        try:
+            # Per-job reporting is left to the parent so worker output doesn't interleave
+            generate_crack_image(pipe, image_path, mask_path, output_path, device=device,
+                                 verbose=False, **gen_kwargs)
+            error = None
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - job_start
+        busy_time += elapsed
+        num_jobs += 1
+        result_conn.send(("job", worker_id, mask_path, output_path, elapsed, error))
+
+    total_time = time.perf_counter() - start
+    result_conn.send(("done", worker_id, num_jobs, load_time, busy_time, total_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Batch crack image generation sharded across pinned worker processes."
+    )
+    parser.add_argument("original_images_dir", type=str,
+                        help="Directory with the cropped original images")
+    parser.add_argument("generated_masks_dir", type=str,
+                        help="Directory containing the cracks_* mask subfolders")
+    parser.add_argument("output_dir", type=str,
+                        help="Directory to save the generated crack images")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes, each with its own pipeline (default: 1)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Physical cores (and torch threads) per worker (default: available physical cores // workers)")
+    parser.add_argument("--device", type=str, default="cpu", choices=["cpu", "cuda"],
+                        help="Device to run the pipelines on (default: cpu)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Random seed for reproducibility")
+    parser.add_argument("--guidance_scale", type=float, default=90,
+                        help="Guidance scale for prompt adherence (default: 90)")
+    parser.add_argument("--controlnet_scale", type=float, default=3.0,
+                        help="ControlNet conditioning scale (default: 3.0)")
+    parser.add_argument("--inference_steps", type=int, default=200,
+                        help="Number of inference steps (default: 200)")
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.original_images_dir):
+        parser.error(f"Original images directory not found: {args.original_images_dir}")
+    if not os.path.isdir(args.generated_masks_dir):
+        parser.error(f"Generated masks directory not found: {args.generated_masks_dir}")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.threads is not None and args.threads < 1:
+        parser.error("--threads must be at least 1")
+
+    jobs, missing = find_jobs(args.original_images_dir, args.generated_masks_dir, args.output_dir)
+
+    # Every worker loads a full pipeline, so don't start more than there are jobs
+    num_workers = max(1, min(args.workers, len(jobs)))
+
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    cores = physical_cores(cpus)
+    threads = args.threads if args.threads is not None else max(1, len(cores) // num_workers)
+    try:
+        cpu_sets = partition_cores(cores, num_workers, threads)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("Starting batch crack generation...")
+    print(f"Original images: {args.original_images_dir}")
+    print(f"Masks directory: {args.generated_masks_dir}")
+    print(f"Output directory: {args.output_dir}")
+    print(f"Seed: {args.seed}")
+    print(f"Guidance scale: {args.guidance_scale}")
+    print(f"ControlNet scale: {args.controlnet_scale}")
+    print(f"Inference steps: {args.inference_steps}")
+    print(f"Jobs: {len(jobs)}")
+    print(f"Workers: {num_workers} x {threads} threads on {len(cores)} physical cores "
+          f"({len(cpus)} logical CPUs, {args.device})")
+    print("==================================================")
+    for mask_path in missing:
+        print(f"  ⚠ Warning: Original image not found for mask: {mask_path}")
+
+    if not jobs:
+        print("No masks with a matching original image found, nothing to do.")
+        print("Total processed: 0")
+        print(f"Total failed: {len(missing)}")
+        return
+    if num_workers < args.workers:
+        print(f"  ⚠ Warning: Only {len(jobs)} jobs, starting {num_workers} workers instead of {args.workers}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    gen_kwargs = {
+        "seed": args.seed,
+        "guidance_scale": args.guidance_scale,
+        "controlnet_scale": args.controlnet_scale,
+        "inference_steps": args.inference_steps,
+    }
+
+    # Spawn so each worker starts with fresh thread pools instead of a forked copy of ours
+    ctx = mp.get_context("spawn")
+    job_queue = ctx.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    for _ in range(num_workers):
+        job_queue.put(None)
+    # Jobs may be left unread if the workers die or the run is interrupted, so
+    # never let interpreter shutdown wait on the feeder thread flushing them
+    job_queue.cancel_join_thread()
+
+    start = time.perf_counter()
+    processes = []
+    result_conns = {}
+    total_processed = 0
+    ready_at = {}
+    in_flight = {}
+    worker_stats = {}
+    worker_errors = {}
+    try:
+        for worker_id, worker_cpus in enumerate(cpu_sets):
+            # One pipe per worker: a worker that dies shows up as EOF on its end
+            reader, writer = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=worker,
+                            args=(worker_id, worker_cpus, threads, args.device, gen_kwargs,
+                                  job_queue, writer))
+            p.start()
+            writer.close()
+            processes.append(p)
+            result_conns[reader] = worker_id
+
+        while result_conns:
+            for conn in mp_connection.wait(list(result_conns)):
+                worker_id = result_conns[conn]
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    del result_conns[conn]
+                    if worker_id not in worker_stats and worker_id not in worker_errors:
+                        processes[worker_id].join()
+                        exitcode = processes[worker_id].exitcode
+                        worker_errors[worker_id] = f"crashed (exit code {exitcode})"
+                        print(f"  ✗ Worker {worker_id} exited unexpectedly (exit code {exitcode})")
+                        if worker_id in in_flight:
+                            print(f"  ✗ [worker {worker_id}] Error processing: {in_flight.pop(worker_id)}")
+                    continue
+
+                kind = message[0]
+                if kind == "ready":
+                    ready_at[worker_id] = time.perf_counter()
+                elif kind == "failed":
+                    worker_errors[worker_id] = f"failed to load pipeline ({message[2]})"
+                    print(f"  ✗ Worker {worker_id} failed to load pipeline: {message[2]}")
+                elif kind == "start":
+                    in_flight[worker_id] = message[2]
+                elif kind == "job":
+                    _, _, mask_path, output_path, elapsed, error = message
+                    in_flight.pop(worker_id, None)
+                    if error is None:
+                        total_processed += 1
+                        print(f"  ✓ [worker {worker_id}] {os.path.basename(mask_path)} -> "
+                              f"{os.path.basename(output_path)} ({elapsed:.1f}s)")
+                    else:
+                        print(f"  ✗ [worker {worker_id}] Error processing {os.path.basename(mask_path)}: {error}")
+                else:
+                    _, _, num_jobs, load_time, busy_time, total_time = message
+                    worker_stats[worker_id] = (num_jobs, load_time, busy_time, total_time)
+    except KeyboardInterrupt:
+        print("==================================================")
+        print("✗ Interrupted, stopping workers.")
+        for mask_path in in_flight.values():
+            print(f"  ✗ Not finished: {mask_path}")
+        print(f"Total processed: {total_processed}")
+        sys.exit(130)
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+    end = time.perf_counter()
+    wall_time = end - start
+
+    if not ready_at:
+        print("==================================================")
+        print("✗ Error: No worker finished loading the pipeline, aborting.")
+        sys.exit(1)
+
+    # Missing originals and jobs lost with a crashed worker count as failed
+    total_failed = len(missing) + len(jobs) - total_processed
+    # Throughput once the first pipeline is up, so extra workers' model loads don't hide steady-state gains
+    steady_time = end - min(ready_at.values())
+
+    print("==================================================")
+    print("Batch processing complete!")
+    print(f"Total processed: {total_processed}")
+    print(f"Total failed: {total_failed}")
+    print(f"Wall time: {wall_time:.1f}s (first pipeline ready after {wall_time - steady_time:.1f}s)")
+    if wall_time > 0:
+        print(f"Throughput (wall time): {total_processed / wall_time * 60:.2f} images/min")
+    if steady_time > 0:
+        print(f"Throughput (after first pipeline load): {total_processed / steady_time * 60:.2f} images/min")
+    print("Per-worker utilization (busy time / time since its pipeline was ready):")
+    for worker_id in range(len(processes)):
+        label = f"worker {worker_id} (CPUs {format_cpu_list(cpu_sets[worker_id])})"
+        if worker_id in worker_errors:
+            print(f"  {label}: {worker_errors[worker_id]}")
+            continue
+        num_jobs, load_time, busy_time, total_time = worker_stats[worker_id]
+        active_time = end - ready_at.get(worker_id, start)
+        utilization = busy_time / active_time * 100 if active_time > 0 else 0.0
+        print(f"  {label}: {num_jobs} jobs, load {load_time:.1f}s, busy {busy_time:.1f}s, "
+              f"idle {total_time - load_time - busy_time:.1f}s, utilization {utilization:.1f}%")
+    print(f"Output saved to: {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -9,90 +9,151 @@ import argparse
 import sys
 
 # =========================
-# Parse command line arguments
+# Define prompt
 # =========================
-parser = argparse.ArgumentParser(description="ControlNet inpainting with crack generation")
-parser.add_argument("image_path", help="Path to the original image")
-parser.add_argument("mask_path", help="Path to the mask image")
-parser.add_argument("--output_path", default=None, help="Path to save output (default: original_image_with_cracks.png)")
-parser.add_argument("--seed", type=int, default=1, help="Random seed for reproducibility")
-parser.add_argument("--guidance_scale", type=float, default=70, help="Guidance scale for prompt adherence")
-parser.add_argument("--controlnet_scale", type=float, default=2.5, help="ControlNet conditioning scale")
-parser.add_argument("--inference_steps", type=int, default=200, help="Number of inference steps")
+PROMPT = ("Ultra-realistic high resolution macro photograph of jagged dark deep recessed cracks in a concrete wall, thin hairline fractures blending naturally with the surface, subtle shadow and depth, photorealistic detail")
 
-args = parser.parse_args()
 
-# =========================
-# Load images
-# =========================
-try:
-    init_image = load_image(args.image_path)
-    mask_image = load_image(args.mask_path)
-    print(f"✓ Loaded image from: {args.image_path}")
-    print(f"✓ Loaded mask from: {args.mask_path}")
-except FileNotFoundError as e:
-    print(f"✗ Error: {e}")
-    sys.exit(1)
+def preprocess_mask(mask_image):
+    """
+    Build the ControlNet conditioning image from a crack mask.
 
+    Args:
+        mask_image: PIL image of the crack mask
 
-# =========================
-# Preprocess mask
-# =========================
-# Convert mask to grayscale numpy array
-mask_np = np.array(mask_image.convert("L"))
-# Dilate cracks to make them more visible
-mask_np = cv2.dilate(mask_np, np.ones((3, 3), np.uint8), iterations=1)
-# Optional: convert mask to Canny edges for ControlNet
-control_edges = cv2.Canny(mask_np, 100, 200)
-control_image = Image.fromarray(control_edges)
+    Returns:
+        PIL image with the Canny edges of the dilated mask
+    """
+    # Convert mask to grayscale numpy array
+    mask_np = np.array(mask_image.convert("L"))
+    # Dilate cracks to make them more visible
+    mask_np = cv2.dilate(mask_np, np.ones((3, 3), np.uint8), iterations=1)
+    # Optional: convert mask to Canny edges for ControlNet
+    control_edges = cv2.Canny(mask_np, 100, 200)
+    return Image.fromarray(control_edges)
 
-# =========================
-# Setup generator
-# =========================
-generator = torch.Generator(device="cuda").manual_seed(args.seed)
 
-# =========================
-# Load ControlNet + pipeline
-# =========================
-print("Loading ControlNet model...")
-controlnet = ControlNetModel.from_pretrained(
-    "lllyasviel/control_v11p_sd15_inpaint", torch_dtype=torch.float16
-)
-print("Loading Stable Diffusion pipeline...")
-pipe = StableDiffusionControlNetInpaintPipeline.from_pretrained(
-    "runwayml/stable-diffusion-v1-5", controlnet=controlnet, torch_dtype=torch.float16
-)
-pipe.scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
-pipe.enable_model_cpu_offload()
-print("✓ Models loaded successfully")
+def load_pipeline(device="cuda"):
+    """
+    Load the ControlNet inpainting pipeline.
 
-# =========================
-# Define prompt
-# =========================
-prompt = ("Ultra-realistic high resolution macro photograph of jagged dark deep recessed cracks in a concrete wall, thin hairline fractures blending naturally with the surface, subtle shadow and depth, photorealistic detail")
+    On CUDA the models are loaded in float16 with model CPU offload; on CPU
+    they are loaded in float32 since half precision is not supported there.
 
+    Args:
+        device: Torch device to run on ("cuda" or "cpu")
 
-# =========================
-# Generate image
-# =========================
-print("Generating image with ControlNet inpainting...")
-image = pipe(
-    prompt=prompt,
-    num_inference_steps=args.inference_steps,
-    generator=generator,
-    eta=1,  
-    image=init_image,
-    mask_image=mask_image,
-    control_image=control_image,
-    guidance_scale=args.guidance_scale,
-    controlnet_conditioning_scale=args.controlnet_scale
-).images[0]
-
-# Save output
-if args.output_path is None:
-    output_path = args.image_path.replace(".png", "_with_cracks.png")
-else:
-    output_path = args.output_path
-
-image.save(output_path)
-print(f"✓ Image saved to: {output_path}")
+    Returns:
+        StableDiffusionControlNetInpaintPipeline ready for inference
+    """
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    print("Loading ControlNet model...")
+    controlnet = ControlNetModel.from_pretrained(
+        "lllyasviel/control_v11p_sd15_inpaint", torch_dtype=dtype
+    )
+    print("Loading Stable Diffusion pipeline...")
+    pipe = StableDiffusionControlNetInpaintPipeline.from_pretrained(
+        "runwayml/stable-diffusion-v1-5", controlnet=controlnet, torch_dtype=dtype
+    )
+    pipe.scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
+    if device == "cuda":
+        pipe.enable_model_cpu_offload()
+    else:
+        pipe.to(device)
+    print("✓ Models loaded successfully")
+    return pipe
+
+
+def generate_crack_image(pipe, image, mask, output_path, seed=1, guidance_scale=70,
+                         controlnet_scale=2.5, inference_steps=200, device="cuda", verbose=True):
+    """
+    Generate cracks on an image with an already loaded pipeline and save the result.
+
+    Args:
+        pipe: Pipeline returned by load_pipeline
+        image: Path, URL or PIL image of the original image
+        mask: Path, URL or PIL image of the crack mask
+        output_path: Path to save the generated image
+        seed: Random seed for reproducibility
+        guidance_scale: Guidance scale for prompt adherence
+        controlnet_scale: ControlNet conditioning scale
+        inference_steps: Number of inference steps
+        device: Torch device used for the random generator
+        verbose: Print progress messages and the diffusion progress bar
+
+    Returns:
+        The generated PIL image
+    """
+    init_image = load_image(image)
+    mask_image = load_image(mask)
+
+    control_image = preprocess_mask(mask_image)
+    generator = torch.Generator(device=device).manual_seed(seed)
+
+    # Also silences the per-step progress bar
+    pipe.set_progress_bar_config(disable=not verbose)
+    if verbose:
+        print("Generating image with ControlNet inpainting...")
+    result = pipe(
+        prompt=PROMPT,
+        num_inference_steps=inference_steps,
+        generator=generator,
+        eta=1,
+        image=init_image,
+        mask_image=mask_image,
+        control_image=control_image,
+        guidance_scale=guidance_scale,
+        controlnet_conditioning_scale=controlnet_scale
+    ).images[0]
+
+    result.save(output_path)
+    if verbose:
+        print(f"✓ Image saved to: {output_path}")
+    return result
+
+
+def main():
+    # =========================
+    # Parse command line arguments
+    # =========================
+    parser = argparse.ArgumentParser(description="ControlNet inpainting with crack generation")
+    parser.add_argument("image_path", help="Path to the original image")
+    parser.add_argument("mask_path", help="Path to the mask image")
+    parser.add_argument("--output_path", default=None, help="Path to save output (default: original_image_with_cracks.png)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for reproducibility")
+    parser.add_argument("--guidance_scale", type=float, default=70, help="Guidance scale for prompt adherence")
+    parser.add_argument("--controlnet_scale", type=float, default=2.5, help="ControlNet conditioning scale")
+    parser.add_argument("--inference_steps", type=int, default=200, help="Number of inference steps")
+
+    args = parser.parse_args()
+
+    # =========================
+    # Load images
+    # =========================
+    try:
+        init_image = load_image(args.image_path)
+        mask_image = load_image(args.mask_path)
+        print(f"✓ Loaded image from: {args.image_path}")
+        print(f"✓ Loaded mask from: {args.mask_path}")
+    except FileNotFoundError as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
+
+    if args.output_path is None:
+        output_path = args.image_path.replace(".png", "_with_cracks.png")
+    else:
+        output_path = args.output_path
+
+    pipe = load_pipeline("cuda")
+    generate_crack_image(
+        pipe, init_image, mask_image, output_path,
+        seed=args.seed,
+        guidance_scale=args.guidance_scale,
+        controlnet_scale=args.controlnet_scale,
+        inference_steps=args.inference_steps,
+        device="cuda",
+    )
+
+
+if __name__ == "__main__":
+    main()